@@ -1,128 +1,253 @@
-from flask import Blueprint, jsonify, request, make_response, current_app
-import json
-import sqlite3
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context
+import os
+import hashlib
+import csv
 import time
+import logging
+import threading
+import atexit
+from datetime import datetime
+from io import StringIO
+import orjson
+from cachetools import TTLCache
 from sensor import SEN0460, calculate_aqi
-from database import insert_reading, get_data, export_data, cleanup_old_data
+from database import insert_reading, insert_reading_batch, get_data, export_data, cleanup_old_data
 from config import load_settings, save_settings, get_location
+from db_pool import get_conn, dict_factory
 
 api = Blueprint('api', __name__)
 
-sensor = SEN0460()
+_sensor = None  # created on first use by get_sensor()
 sensor_initialized = False
-last_reading_time = 0
+last_reading_time = 0  # wall-clock ms of the last reading, reported to clients
+last_reading_at = None  # time.monotonic() of the last reading, for interval scheduling
 reading_mode = "realtime"
+sensor_awake_since = None  # time.monotonic() of the last wake-up, None while in low-power mode
+sensor_lock = threading.Lock()  # serializes access to the sensor between the poller and /read_now
+latest_reading = None  # most recent reading (or error) published by poll_loop
+pending_readings = []  # rows buffered by poll_loop until the next batch insert
+pending_lock = threading.Lock()  # guards pending_readings between the poller and shutdown flushes
+pending_since = 0  # time.monotonic() of the oldest buffered row
+graph_cache = TTLCache(maxsize=64, ttl=5)  # /graph_data (body, etag) pairs keyed by (param, range, location)
+graph_cache_lock = threading.Lock()
+locations_json = None  # cached /locations (body, etag), rebuilt when a new location is stored
+known_locations = set()  # locations included in locations_json
 
-@api.route('/data')
-def data():
-    global sensor_initialized, last_reading_time, reading_mode
-    try:
-        settings = load_settings()
-        current_mode = settings.get('reading_mode', 'realtime')
-        current_time = int(time.time() * 1000)  # Current time in milliseconds
-        
-        # For lazy mode, check if we should read (manual trigger only)
-        if current_mode == 'lazy':
-            # Only read if it's been requested (via /api/read_now endpoint)
-            if 'read_now' not in request.args:
-                return jsonify({
-                    'mode': 'lazy',
-                    'message': 'Lazy mode - use Read Now button or /api/read_now',
-                    'last_reading': last_reading_time
-                })
-        
-        # Check if enough time has passed for the current mode
-        interval = settings.get('custom_interval', 5000)
-        if current_time - last_reading_time < interval and current_mode != 'lazy':
-            return jsonify({
-                'mode': current_mode,
-                'message': f'Waiting for next reading in {((interval - (current_time - last_reading_time)) // 1000) + 1} seconds',
-                'last_reading': last_reading_time
-            })
-        
+# Number of rows written per streamed chunk in /export
+EXPORT_CHUNK_ROWS = 500
+EXPORT_FIELDS = ('timestamp', 'location', 'pm1', 'pm25', 'pm10', 'aqi', 'particles')
+# Bytes read from the end of app.log by /logs
+LOG_TAIL_BYTES = 64 * 1024
+# Keep the sensor awake when the next reading is due within this many ms
+KEEP_AWAKE_MS = 20000
+# Seconds between poller checks, and before retrying after a failed reading
+POLL_TICK_S = 1
+POLL_RETRY_S = 10
+# Realtime mode intervals in ms: 5s, 10s, 20s, 40s, 60s
+REALTIME_INTERVALS = {'5': 5000, '10': 10000, '20': 20000, '40': 40000, '60': 60000}
+# Less aggressive mode intervals in ms: 5min, 10min, 30min, 1h, 2h, 4h, 8h, 24h
+LESS_AGGRESSIVE_INTERVALS = {
+    '5': 300000,      # 5 minutes
+    '10': 600000,     # 10 minutes
+    '30': 1800000,    # 30 minutes
+    '60': 3600000,    # 1 hour
+    '120': 7200000,   # 2 hours
+    '240': 14400000,  # 4 hours
+    '480': 28800000,  # 8 hours
+    '1440': 86400000  # 24 hours
+}
+# Flush buffered poller readings once this many are pending or the oldest is this old
+BATCH_ROWS = 20
+BATCH_MS = 30000
+
+def get_sensor():
+    """Return the shared SEN0460, opening the I2C bus on first use."""
+    global _sensor
+    if _sensor is None:
+        _sensor = SEN0460()
+    return _sensor
+
+def wake_sensor(stabilize_ms):
+    """Wake the sensor, waiting for a stable reading only after a cold start."""
+    global sensor_awake_since
+    now = time.monotonic()
+    if sensor_awake_since is None:
+        get_sensor().awake()
+        sensor_awake_since = now
+    remaining = stabilize_ms / 1000 - (now - sensor_awake_since)
+    if remaining > 0:
+        time.sleep(remaining)
+
+def sleep_sensor():
+    """Put the sensor into low-power mode."""
+    global sensor_awake_since
+    get_sensor().set_lowpower()
+    sensor_awake_since = None
+
+def queue_reading(location, pm1, pm25, pm10, aqi, particles):
+    """Buffer a reading for the next batch insert; same arguments as insert_reading."""
+    global pending_since
+    with pending_lock:
+        if not pending_readings:
+            pending_since = time.monotonic()
+        pending_readings.append((datetime.now().isoformat(), location, pm1, pm25, pm10, aqi, particles))
+
+def readings_changed(locations=None):
+    """Drop cached responses after the readings table changes.
+
+    locations lists the locations that were written; None means rows may also
+    have been removed, so the cached location list is always rebuilt.
+    """
+    global locations_json
+    with graph_cache_lock:
+        graph_cache.clear()
+    if locations is None or not known_locations.issuperset(locations):
+        locations_json = None
+
+def store_reading(location, pm1, pm25, pm10, aqi, particles):
+    """Insert a reading immediately; same arguments as insert_reading."""
+    insert_reading(location, pm1, pm25, pm10, aqi, particles)
+    readings_changed([location])
+
+def flush_readings():
+    """Write all buffered readings to the database, keeping them buffered if the insert fails."""
+    with pending_lock:
+        if not pending_readings:
+            return
+        rows = list(pending_readings)
+        insert_reading_batch(rows)
+        del pending_readings[:len(rows)]
+    readings_changed([row[1] for row in rows])
+
+atexit.register(flush_readings)
+
+def take_reading(settings, stabilize_ms, power_down, store=store_reading):
+    """Read the sensor and pass the reading to store(); returns it, or an {'error': ...} dict."""
+    global sensor_initialized, sensor_awake_since
+    with sensor_lock:
+        sensor = get_sensor()
         # Initialize sensor if not already done
         if not sensor_initialized:
+            woke = time.monotonic()
             if not sensor.init_sensor():
-                return jsonify({'error': 'Failed to initialize sensor'})
+                return {'error': 'Failed to initialize sensor'}
             sensor_initialized = True
-        
+            # init_sensor() already woke the sensor, so count its wait toward stabilization
+            sensor_awake_since = woke
+
         # Wake sensor and wait for stable reading
-        sensor.awake()
-        sleep_time = 2 if current_mode == 'realtime' else 3
-        time.sleep(sleep_time)
-        
+        wake_sensor(stabilize_ms)
+
         concentrations = sensor.gain_all_concentrations()
         counts = sensor.gain_particle_counts()
         version = sensor.gain_version()
-        
-        # Put sensor to sleep based on mode
-        if settings['power_save'] or current_mode != 'realtime':
-            sensor.set_lowpower()
-            
-        if concentrations['pm25'] is not None:
-            aqi = calculate_aqi(concentrations['pm25'])
-            location = settings.get('manual_location', '') or get_location()
-            insert_reading(location, concentrations['pm1'], concentrations['pm25'], concentrations['pm10'], aqi, counts)
-            last_reading_time = current_time
-            current_app.logger.info(f"Inserted reading: PM2.5={concentrations['pm25']}, AQI={aqi}, Mode={current_mode}")
-            return jsonify({
-                'pm1': concentrations['pm1'],
-                'pm25': concentrations['pm25'],
-                'pm10': concentrations['pm10'],
-                'particles': counts,
-                'version': version,
-                'aqi': aqi,
-                'mode': current_mode,
-                'next_reading': current_time + interval
-            })
-        else:
-            return jsonify({'error': 'Failed to read sensor - invalid readings'})
-    except Exception as e:
-        current_app.logger.error(f"Sensor error: {str(e)}")
-        return jsonify({'error': f'Sensor error: {str(e)}'})
+
+        if power_down:
+            sleep_sensor()
+
+    if concentrations['pm25'] is None:
+        return {'error': 'Failed to read sensor - invalid readings'}
+    aqi = calculate_aqi(concentrations['pm25'])
+    location = settings.get('manual_location', '') or get_location()
+    store(location, concentrations['pm1'], concentrations['pm25'], concentrations['pm10'], aqi, counts)
+    return {
+        'pm1': concentrations['pm1'],
+        'pm25': concentrations['pm25'],
+        'pm10': concentrations['pm10'],
+        'particles': counts,
+        'version': version,
+        'aqi': aqi
+    }
+
+def poll_loop():
+    """Background thread: read the sensor on the configured interval and publish the latest reading."""
+    global last_reading_time, last_reading_at, latest_reading
+    while True:
+        failed = False
+        try:
+            settings = load_settings()
+            current_mode = settings.get('reading_mode', 'realtime')
+            interval = settings.get('custom_interval', 5000)
+            due = last_reading_at is None or (time.monotonic() - last_reading_at) * 1000 >= interval
+            if current_mode == 'lazy' and sensor_awake_since is not None:
+                # No readings are scheduled in lazy mode, so don't leave the laser and fan running
+                with sensor_lock:
+                    sleep_sensor()
+            elif current_mode != 'lazy' and due:
+                # Put sensor to sleep based on mode, unless the next reading is imminent
+                power_down = (settings['power_save'] or current_mode != 'realtime') and interval > KEEP_AWAKE_MS
+                reading = take_reading(settings, 2000 if current_mode == 'realtime' else 3000, power_down, queue_reading)
+                if 'error' in reading:
+                    logging.error(reading['error'])
+                    latest_reading = reading
+                    failed = True
+                else:
+                    last_reading_at = time.monotonic()
+                    current_time = int(time.time() * 1000)  # Current time in milliseconds
+                    last_reading_time = current_time
+                    latest_reading = {**reading, 'mode': current_mode, 'last_reading': current_time,
+                                      'next_reading': current_time + interval}
+                    logging.info(f"Inserted reading: PM2.5={reading['pm25']}, AQI={reading['aqi']}, Mode={current_mode}")
+        except Exception as e:
+            logging.error(f"Sensor error: {str(e)}")
+            latest_reading = {'error': f'Sensor error: {str(e)}'}
+            failed = True
+        # Commit buffered readings together instead of one transaction per reading
+        if pending_readings and (len(pending_readings) >= BATCH_ROWS or
+                                 (time.monotonic() - pending_since) * 1000 >= BATCH_MS):
+            try:
+                flush_readings()
+            except Exception as e:
+                # Rows stay buffered and the flush is retried on the next tick
+                logging.error(f"Database error saving {len(pending_readings)} buffered readings: {str(e)}")
+                failed = True
+        time.sleep(POLL_RETRY_S if failed else POLL_TICK_S)
+
+@api.route('/data')
+def data():
+    """Return the latest reading published by the background poller."""
+    settings = load_settings()
+    current_mode = settings.get('reading_mode', 'realtime')
+
+    # For lazy mode, check if we should read (manual trigger only)
+    if current_mode == 'lazy':
+        if 'read_now' in request.args:
+            return read_now()
+        return jsonify({
+            'mode': 'lazy',
+            'message': 'Lazy mode - use Read Now button or /api/read_now',
+            'last_reading': last_reading_time
+        })
+
+    if latest_reading is None:
+        return jsonify({
+            'mode': current_mode,
+            'message': 'Waiting for first reading',
+            'last_reading': last_reading_time
+        })
+    return jsonify(latest_reading)
 
 @api.route('/read_now')
 def read_now():
     """Force a reading regardless of mode (for lazy mode)"""
-    global last_reading_time, sensor_initialized
+    global last_reading_time, last_reading_at, latest_reading
     try:
         settings = load_settings()
-        
-        # Initialize sensor if not already done
-        if not sensor_initialized:
-            if not sensor.init_sensor():
-                return jsonify({'error': 'Failed to initialize sensor'})
-            sensor_initialized = True
-        
-        # Wake sensor and wait for stable reading
-        sensor.awake()
-        import time
-        time.sleep(3)
-        
-        concentrations = sensor.gain_all_concentrations()
-        counts = sensor.gain_particle_counts()
-        version = sensor.gain_version()
-        
         # Put sensor to sleep after reading
-        sensor.set_lowpower()
-            
-        if concentrations['pm25'] is not None:
-            aqi = calculate_aqi(concentrations['pm25'])
-            location = settings.get('manual_location', '') or get_location()
-            insert_reading(location, concentrations['pm1'], concentrations['pm25'], concentrations['pm10'], aqi, counts)
-            last_reading_time = int(time.time() * 1000)
-            current_app.logger.info(f"Manual reading: PM2.5={concentrations['pm25']}, AQI={aqi}")
-            return jsonify({
-                'pm1': concentrations['pm1'],
-                'pm25': concentrations['pm25'],
-                'pm10': concentrations['pm10'],
-                'particles': counts,
-                'version': version,
-                'aqi': aqi,
-                'manual': True
-            })
-        else:
-            return jsonify({'error': 'Failed to read sensor - invalid readings'})
+        reading = take_reading(settings, 3000, True)
+        if 'error' in reading:
+            return jsonify(reading)
+        last_reading_at = time.monotonic()
+        current_time = int(time.time() * 1000)
+        last_reading_time = current_time
+        latest_reading = {
+            **reading,
+            'mode': settings.get('reading_mode', 'realtime'),
+            'last_reading': current_time,
+            'next_reading': current_time + settings.get('custom_interval', 5000)
+        }
+        current_app.logger.info(f"Manual reading: PM2.5={reading['pm25']}, AQI={reading['aqi']}")
+        return jsonify({**reading, 'manual': True})
     except Exception as e:
         current_app.logger.error(f"Manual reading error: {str(e)}")
         return jsonify({'error': f'Sensor error: {str(e)}'})
@@ -135,22 +260,9 @@ def settings_api():
         # Validate and set custom interval based on mode
         mode = data.get('reading_mode', 'realtime')
         if mode == 'realtime':
-            # Realtime mode: 5s, 10s, 20s, 40s, 60s
-            interval_map = {'5': 5000, '10': 10000, '20': 20000, '40': 40000, '60': 60000}
-            data['custom_interval'] = interval_map.get(data.get('interval', '5'), 5000)
+            data['custom_interval'] = REALTIME_INTERVALS.get(data.get('interval', '5'), 5000)
         elif mode == 'less_aggressive':
-            # Less aggressive mode: 5min, 10min, 30min, 1h, 2h, 4h, 8h, 24h
-            interval_map = {
-                '5': 300000,      # 5 minutes
-                '10': 600000,     # 10 minutes  
-                '30': 1800000,    # 30 minutes
-                '60': 3600000,    # 1 hour
-                '120': 7200000,   # 2 hours
-                '240': 14400000,  # 4 hours
-                '480': 28800000,  # 8 hours
-                '1440': 86400000  # 24 hours
-            }
-            data['custom_interval'] = interval_map.get(data.get('interval', '5'), 300000)
+            data['custom_interval'] = LESS_AGGRESSIVE_INTERVALS.get(data.get('interval', '5'), 300000)
         elif mode == 'lazy':
             # Lazy mode: no automatic readings
             data['custom_interval'] = 0
@@ -160,21 +272,49 @@ def settings_api():
     else:
         return jsonify(load_settings())
 
+def json_body(data):
+    """Serialize data once for caching; returns (body, etag)."""
+    body = orjson.dumps(data)
+    return body, hashlib.md5(body).hexdigest()
+
+def cached_json_response(body, etag, max_age=None):
+    """Serve a cached JSON body, answering 304 when the client's If-None-Match already matches."""
+    response = Response(body, mimetype='application/json')
+    # Weak, so the tag still matches after flask-compress encodes the body
+    response.set_etag(etag, weak=True)
+    if max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
 @api.route('/graph_data')
 def graph_data():
     param = request.args.get('param', 'aqi')
     range_type = request.args.get('range', 'day')
     location = request.args.get('location', None)
-    data = get_data(param, range_type, location)
-    return jsonify(data)
+    key = (param, range_type, location)
+    with graph_cache_lock:
+        cached = graph_cache.get(key)
+    if cached is None:
+        try:
+            cached = json_body(get_data(param, range_type, location))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        with graph_cache_lock:
+            graph_cache[key] = cached
+    return cached_json_response(*cached, max_age=int(graph_cache.ttl))
 
 @api.route('/locations')
 def get_locations():
-    with sqlite3.connect('air_quality.db') as conn:
-        c = conn.cursor()
-        c.execute('SELECT DISTINCT location FROM readings')
+    global locations_json, known_locations
+    if locations_json is None:
+        c = get_conn().cursor()
+        c.execute('SELECT location FROM readings GROUP BY location')
         locations = [row[0] for row in c.fetchall()]
-    return jsonify(locations)
+        known_locations = set(locations)
+        locations_json = json_body(locations)
+    return cached_json_response(*locations_json)
 
 @api.route('/export')
 def export():
@@ -184,80 +324,87 @@ def export():
     location = request.args.get('location')
     data = export_data(start_date, end_date, location)
     if format_type == 'csv':
-        from io import StringIO
-        import csv
-        si = StringIO()
-        writer = csv.DictWriter(si, fieldnames=['timestamp', 'location', 'pm1', 'pm25', 'pm10', 'aqi', 'particles'])
-        writer.writeheader()
-        for row in data:
-            row_copy = row.copy()
-            row_copy['particles'] = json.dumps(row_copy['particles'])
-            writer.writerow(row_copy)
-        output = make_response(si.getvalue())
-        output.headers["Content-Disposition"] = "attachment; filename=air_quality_data.csv"
-        output.headers["Content-type"] = "text/csv"
-        return output
+        def generate():
+            # Emit the CSV in chunks of rows instead of buffering the whole file
+            si = StringIO()
+            writer = csv.writer(si)
+            writer.writerow(EXPORT_FIELDS)
+            for i, row in enumerate(data, 1):
+                writer.writerow((row['timestamp'], row['location'], row['pm1'], row['pm25'], row['pm10'], row['aqi'],
+                                 orjson.dumps(row['particles']).decode()))
+                if i % EXPORT_CHUNK_ROWS == 0:
+                    yield si.getvalue()
+                    si.seek(0)
+                    si.truncate(0)
+            yield si.getvalue()
+
+        return Response(stream_with_context(generate()), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=air_quality_data.csv'})
     else:  # json
-        return jsonify(data)
+        def generate():
+            # Stream the JSON array in chunks of rows, like the CSV branch
+            chunk = [b'[']
+            for i, row in enumerate(data):
+                if i:
+                    chunk.append(b',')
+                chunk.append(orjson.dumps(row))
+                if len(chunk) >= 2 * EXPORT_CHUNK_ROWS:
+                    yield b''.join(chunk)
+                    chunk = []
+            chunk.append(b']')
+            yield b''.join(chunk)
+
+        return Response(stream_with_context(generate()), mimetype='application/json')
 
 @api.route('/readings')
 def readings():
     limit = int(request.args.get('limit', 50))
     offset = int(request.args.get('offset', 0))
     location = request.args.get('location')
-    with sqlite3.connect('air_quality.db') as conn:
-        c = conn.cursor()
-        query = 'SELECT id, timestamp, location, pm1, pm25, pm10, aqi FROM readings WHERE 1=1'
-        params = []
-        if location:
-            query += ' AND location = ?'
-            params.append(location)
-        query += ' ORDER BY timestamp DESC LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-        c.execute(query, params)
-        rows = c.fetchall()
-    data = []
-    for row in rows:
-        id_, ts, loc, pm1, pm25, pm10, aqi = row
-        data.append({
-            'id': id_,
-            'timestamp': ts,
-            'location': loc,
-            'pm1': pm1,
-            'pm25': pm25,
-            'pm10': pm10,
-            'aqi': aqi
-        })
-    return jsonify(data)
+    c = get_conn().cursor()
+    query = 'SELECT id, timestamp, location, pm1, pm25, pm10, aqi FROM readings WHERE 1=1'
+    params = []
+    if location:
+        query += ' AND location = ?'
+        params.append(location)
+    query += ' ORDER BY timestamp DESC LIMIT ? OFFSET ?'
+    params.extend([limit, offset])
+    c.row_factory = dict_factory
+    c.execute(query, params)
+    return jsonify(c.fetchall())
 
 @api.route('/cleanup', methods=['POST'])
 def cleanup():
     days = int(request.get_json().get('days', 365))
     cleanup_old_data(days)
+    readings_changed()
     return jsonify({'status': 'cleaned'})
 
 @api.route('/logs')
 def logs():
     try:
-        with open('app.log', 'r') as f:
-            lines = f.readlines()
+        # Only read the end of the file; app.log can be large on a long-running device
+        with open('app.log', 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - LOG_TAIL_BYTES))
+            lines = f.read().decode('utf-8', 'replace').splitlines()
+        if size > LOG_TAIL_BYTES:
+            lines = lines[1:]  # first line is likely cut off mid-way
         parsed_logs = []
         if not lines:
             parsed_logs = [{'timestamp': 'N/A', 'level': 'INFO', 'message': 'No logs available yet'}]
         else:
             for line in lines[-100:]:  # last 100 lines
                 line = line.strip()
-                if ' - ' in line:
-                    parts = line.split(' - ', 2)
-                    if len(parts) >= 2:
-                        timestamp = parts[0]
-                        level = parts[1] if len(parts) > 2 else 'INFO'
-                        message = parts[2] if len(parts) > 2 else parts[1]
-                        parsed_logs.append({'timestamp': timestamp, 'level': level, 'message': message})
-                    else:
-                        parsed_logs.append({'timestamp': 'N/A', 'level': 'INFO', 'message': line})
-                else:
+                timestamp, sep, rest = line.partition(' - ')
+                if not sep:
                     parsed_logs.append({'timestamp': 'N/A', 'level': 'INFO', 'message': line})
+                    continue
+                level, sep, message = rest.partition(' - ')
+                if not sep:
+                    level, message = 'INFO', rest
+                parsed_logs.append({'timestamp': timestamp, 'level': level, 'message': message})
         return jsonify(parsed_logs)
     except Exception as e:
         return jsonify({'error': str(e)})
\ No newline at end of file
@@ -1,39 +1,72 @@
-from flask import Flask, render_template
+from flask import Flask, render_template, request
+from flask_orjson import OrjsonProvider
+from flask_compress import Compress
+from waitress import serve
 import socket
 import platform
 import logging
+import threading
+import signal
+import sys
+from logging.handlers import RotatingFileHandler
 from database import init_db
 from config import load_settings, get_location
-from api import api
+from api import api, poll_loop, flush_readings
 
-# Configure logging to file
-logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Configure werkzeug logger to also log to file
-werkzeug_logger = logging.getLogger('werkzeug')
-werkzeug_logger.setLevel(logging.INFO)
-handler = logging.FileHandler('app.log')
+# Configure logging to a size-capped, rotating file
+handler = RotatingFileHandler('app.log', maxBytes=1_000_000, backupCount=3)
 handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-werkzeug_logger.addHandler(handler)
+logging.basicConfig(level=logging.INFO, handlers=[handler])
 
 app = Flask(__name__)
+# Serialize every jsonify() response with orjson instead of the stdlib json module
+app.json = OrjsonProvider(app)
+# Compress JSON, CSV and page responses sent over Wi-Fi
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/csv', 'text/plain', 'text/html', 'text/css']
+app.config['COMPRESS_LEVEL'] = 4
+Compress(app)
 app.register_blueprint(api, url_prefix='/api')
 init_db()
+# Sensor reads happen on this thread; /api/data serves its latest result
+threading.Thread(target=poll_loop, daemon=True).start()
+
+@app.after_request
+def log_request(response):
+    """Write an access line per request, as the Werkzeug dev server did (waitress logs none)."""
+    app.logger.info(f'{request.remote_addr} "{request.method} {request.full_path.rstrip("?")} '
+                    f'{request.environ.get("SERVER_PROTOCOL")}" {response.status_code}')
+    return response
+
+# Host and sensor details do not change at runtime, so look them up once;
+# the IP can change with DHCP and is resolved per page load
+DEVICE_INFO = {
+    'hostname': socket.gethostname(),
+    'platform': platform.platform(),
+    'sensor_model': 'DFRobot SEN0460 PM2.5 Laser Sensor'
+}
+
+def get_ip():
+    """Resolve this host's IP address, or 'Unknown' if the hostname does not resolve."""
+    try:
+        return socket.gethostbyname(DEVICE_INFO['hostname'])
+    except OSError as e:
+        logging.warning(f"Could not resolve IP for {DEVICE_INFO['hostname']}: {e}")
+        return 'Unknown'
 
 @app.route('/')
 def index():
-    hostname = socket.gethostname()
-    ip = socket.gethostbyname(hostname)
     settings = load_settings()
     location = settings.get('manual_location', '') or get_location()
-    device_info = {
-        'hostname': hostname,
-        'ip': ip,
-        'platform': platform.platform(),
-        'sensor_model': 'DFRobot SEN0460 PM2.5 Laser Sensor',
-        'location': location
-    }
+    device_info = {**DEVICE_INFO, 'ip': get_ip(), 'location': location}
     return render_template('index.html', device_info=device_info, settings=settings)
 
+def shutdown(signum, frame):
+    """Save buffered readings before exiting on SIGTERM (make stop / make restart)."""
+    flush_readings()
+    sys.exit(0)
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    # atexit handlers do not run on SIGTERM, so flush from a signal handler instead
+    signal.signal(signal.SIGTERM, shutdown)
+    # Production WSGI server with a thread pool instead of the Werkzeug dev server
+    serve(app, host='0.0.0.0', port=5000, threads=8)
\ No newline at end of file
@@ -1,10 +1,21 @@
 import json
 import os
+import time
 import requests
 
 SETTINGS_FILE = 'settings.json'
+LOCATION_TTL = 3600  # seconds to reuse a detected location
+LOCATION_RETRY = 300  # seconds before retrying a failed lookup
+
+# Parsed settings keyed by the settings file mtime: (mtime, settings)
+_settings_cache = (None, None)
 
 def load_settings():
+    global _settings_cache
+    mtime = os.stat(SETTINGS_FILE).st_mtime if os.path.exists(SETTINGS_FILE) else None
+    cached_mtime, cached = _settings_cache
+    if cached is not None and cached_mtime == mtime:
+        return dict(cached)
     defaults = {
         "update_interval": 5000, 
         "power_save": True, 
@@ -16,16 +27,30 @@ def load_settings():
         with open(SETTINGS_FILE, 'r') as f:
             loaded = json.load(f)
         defaults.update(loaded)
-    return defaults
+    _settings_cache = (mtime, defaults)
+    return dict(defaults)
 
 def save_settings(settings):
+    global _settings_cache
     with open(SETTINGS_FILE, 'w') as f:
         json.dump(settings, f)
+    _settings_cache = (None, None)
+
+# Last IP-based location lookup: (expires_at, location)
+_location_cache = (0, None)
 
 def get_location():
+    global _location_cache
+    now = time.monotonic()
+    expires_at, location = _location_cache
+    if location is not None and now < expires_at:
+        return location
     try:
         response = requests.get('https://ipinfo.io/json', timeout=5)
         data = response.json()
-        return f"{data.get('city', 'Unknown')}, {data.get('region', 'Unknown')}, {data.get('country', 'Unknown')}"
+        location = f"{data.get('city', 'Unknown')}, {data.get('region', 'Unknown')}, {data.get('country', 'Unknown')}"
+        _location_cache = (now + LOCATION_TTL, location)
     except Exception as e:
-        return "Location detection failed"
\ No newline at end of file
+        location = "Location detection failed"
+        _location_cache = (now + LOCATION_RETRY, location)
+    return location
\ No newline at end of file
@@ -1,121 +1,131 @@
-import sqlite3
-import json
+import orjson
 from datetime import datetime, timedelta
+from db_pool import get_conn
 
-DB_FILE = 'air_quality.db'
+INSERT_SQL = 'INSERT INTO readings (timestamp, location, pm1, pm25, pm10, aqi, particles) VALUES (?, ?, ?, ?, ?, ?, ?)'
 
 def init_db():
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS readings (
-            id INTEGER PRIMARY KEY,
-            timestamp TEXT,
-            location TEXT,
-            pm1 REAL,
-            pm25 REAL,
-            pm10 REAL,
-            aqi INTEGER,
-            particles TEXT
-        )''')
-        conn.commit()
+    c = get_conn().cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS readings (
+        id INTEGER PRIMARY KEY,
+        timestamp TEXT,
+        location TEXT,
+        pm1 REAL,
+        pm25 REAL,
+        pm10 REAL,
+        aqi INTEGER,
+        particles TEXT
+    )''')
+    # Serve ORDER BY timestamp and per-location lookups from indexes
+    c.execute('CREATE INDEX IF NOT EXISTS idx_readings_ts ON readings(timestamp DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_readings_loc_ts ON readings(location, timestamp DESC)')
+    # Refresh planner statistics (sampled via the pooled connections' analysis_limit,
+    # so startup stays fast on large histories)
+    c.execute('ANALYZE')
 
 def insert_reading(location, pm1, pm25, pm10, aqi, particles):
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        timestamp = datetime.now().isoformat()
-        particles_json = json.dumps(particles)
-        c.execute('INSERT INTO readings (timestamp, location, pm1, pm25, pm10, aqi, particles) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                   (timestamp, location, pm1, pm25, pm10, aqi, particles_json))
-        conn.commit()
+    timestamp = datetime.now().isoformat()
+    get_conn().execute(INSERT_SQL, (timestamp, location, pm1, pm25, pm10, aqi, orjson.dumps(particles)))
 
-def get_data(param, range_type, location=None):
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        now = datetime.now()
-        if range_type == 'hour':
-            start = now - timedelta(hours=24)
-        elif range_type == 'day':
-            start = now - timedelta(days=7)
-        elif range_type == 'week':
-            start = now - timedelta(weeks=4)
-        elif range_type == 'month':
-            start = now - timedelta(days=365)
-        else:  # year or all
-            start = datetime.min
-
-        query = f'SELECT timestamp, {param}, location FROM readings WHERE timestamp >= ?'
-        params = [start.isoformat()]
-        if location:
-            query += ' AND location = ?'
-            params.append(location)
+def insert_reading_batch(rows):
+    """Insert (timestamp, location, pm1, pm25, pm10, aqi, particles) rows in one transaction."""
+    conn = get_conn()
+    conn.execute('BEGIN')
+    try:
+        conn.executemany(INSERT_SQL, [(ts, loc, pm1, pm25, pm10, aqi, orjson.dumps(particles))
+                                      for ts, loc, pm1, pm25, pm10, aqi, particles in rows])
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
 
-        c.execute(query, params)
-        rows = c.fetchall()
+# Columns get_data() may aggregate
+GRAPH_PARAMS = {'pm1', 'pm25', 'pm10', 'aqi'}
+# SQL expression grouping a reading's timestamp into a time unit per range type
+BUCKET_SQL = {
+    'hour': "strftime('%H:00', timestamp)",
+    'day': "strftime('%Y-%m-%d', timestamp)",
+    # ISO week number: day of year of the Thursday in the reading's Monday-Sunday week
+    'week': "'Week ' || ((CAST(strftime('%j', date(timestamp, '-3 days', 'weekday 4')) AS INTEGER) - 1) / 7 + 1)",
+    'month': "strftime('%Y-%m', timestamp)",
+    'year': "strftime('%Y', timestamp)",
+}
+# get_data() statements keyed by (param, range_type, has_location), built once so
+# every call reuses the same SQL text and hits sqlite3's statement cache
+GRAPH_SQL = {
+    # With MIN(timestamp) present, the bare location column comes from the first
+    # reading in each group
+    (param, range_type, has_location):
+        f'SELECT {bucket} AS bucket, AVG({param}), location, MIN(timestamp) FROM readings WHERE timestamp >= ?'
+        + (' AND location = ?' if has_location else '')
+        + ' GROUP BY bucket ORDER BY bucket'
+    for param in GRAPH_PARAMS
+    for range_type, bucket in BUCKET_SQL.items()
+    for has_location in (False, True)
+}
 
-    # Group by time unit
-    data = {}
-    for ts, value, loc in rows:
-        dt = datetime.fromisoformat(ts)
-        if range_type == 'hour':
-            key = dt.strftime('%H:00')
-        elif range_type == 'day':
-            key = dt.strftime('%Y-%m-%d')
-        elif range_type == 'week':
-            key = f'Week {dt.isocalendar()[1]}'
-        elif range_type == 'month':
-            key = dt.strftime('%Y-%m')
-        else:
-            key = dt.strftime('%Y')
+def get_data(param, range_type, location=None):
+    if param not in GRAPH_PARAMS:
+        raise ValueError(f'Unknown graph parameter: {param}')
+    c = get_conn().cursor()
+    now = datetime.now()
+    if range_type == 'hour':
+        start = now - timedelta(hours=24)
+    elif range_type == 'day':
+        start = now - timedelta(days=7)
+    elif range_type == 'week':
+        start = now - timedelta(weeks=4)
+    elif range_type == 'month':
+        start = now - timedelta(days=365)
+    else:  # year or all
+        start = datetime.min
+        range_type = 'year'
 
-        if key not in data:
-            data[key] = []
-        data[key].append((value, loc))
+    # Group by time unit and average in SQL
+    params = [start.isoformat()]
+    if location:
+        params.append(location)
+    c.execute(GRAPH_SQL[param, range_type, bool(location)], params)
+    return [{'time': key, 'value': value, 'location': loc} for key, value, loc, _ in c.fetchall()]
 
-    # Average values
-    averaged = {}
-    for time_key, value_loc_list in data.items():
-        total = sum(v for v, l in value_loc_list)
-        avg_value = total / len(value_loc_list)
-        # Use the location of the first reading for that time (assuming same location per time)
-        loc = value_loc_list[0][1] if value_loc_list else 'Unknown'
-        averaged[time_key] = {'value': avg_value, 'location': loc}
-    return [{'time': k, 'value': v['value'], 'location': v['location']} for k, v in sorted(averaged.items())]
+# Rows fetched from SQLite at a time by export_data()
+EXPORT_FETCH_ROWS = 1000
 
 def export_data(start_date=None, end_date=None, location=None):
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        query = 'SELECT timestamp, location, pm1, pm25, pm10, aqi, particles FROM readings WHERE 1=1'
-        params = []
-        if start_date:
-            query += ' AND timestamp >= ?'
-            params.append(start_date)
-        if end_date:
-            query += ' AND timestamp <= ?'
-            params.append(end_date)
-        if location:
-            query += ' AND location = ?'
-            params.append(location)
-        query += ' ORDER BY timestamp'
-        c.execute(query, params)
-        rows = c.fetchall()
-    data = []
-    for row in rows:
-        ts, loc, pm1, pm25, pm10, aqi, particles_json = row
-        particles = json.loads(particles_json) if particles_json else {}
-        data.append({
-            'timestamp': ts,
-            'location': loc,
-            'pm1': pm1,
-            'pm25': pm25,
-            'pm10': pm10,
-            'aqi': aqi,
-            'particles': particles
-        })
-    return data
+    c = get_conn().cursor()
+    query = 'SELECT timestamp, location, pm1, pm25, pm10, aqi, particles FROM readings WHERE 1=1'
+    params = []
+    if start_date:
+        query += ' AND timestamp >= ?'
+        params.append(start_date)
+    if end_date:
+        query += ' AND timestamp <= ?'
+        params.append(end_date)
+    if location:
+        query += ' AND location = ?'
+        params.append(location)
+    query += ' ORDER BY timestamp'
+    c.execute(query, params)
+    # Yield rows as they are fetched so memory use does not grow with the history
+    while True:
+        rows = c.fetchmany(EXPORT_FETCH_ROWS)
+        if not rows:
+            break
+        for ts, loc, pm1, pm25, pm10, aqi, particles_json in rows:
+            # Older rows hold JSON text, newer ones orjson bytes; orjson.loads reads both
+            particles = orjson.loads(particles_json) if particles_json else {}
+            yield {
+                'timestamp': ts,
+                'location': loc,
+                'pm1': pm1,
+                'pm25': pm25,
+                'pm10': pm10,
+                'aqi': aqi,
+                'particles': particles
+            }
 
 def cleanup_old_data(days=365):
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
-        c.execute('DELETE FROM readings WHERE timestamp < ?', (cutoff,))
-        conn.commit()
\ No newline at end of file
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    conn = get_conn()
+    conn.execute('DELETE FROM readings WHERE timestamp < ?', (cutoff,))
+    conn.execute('ANALYZE')
\ No newline at end of file
@@ -0,0 +1,26 @@
+import sqlite3
+import threading
+
+DB_FILE = 'air_quality.db'
+
+_local = threading.local()
+
+def get_conn():
+    """Return this thread's SQLite connection, opening and configuring it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+        # analysis_limit is per connection; it keeps every ANALYZE sampled
+        conn.executescript('''
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-8000;
+            PRAGMA analysis_limit=400;
+        ''')
+        _local.conn = conn
+    return conn
+
+def dict_factory(cursor, row):
+    """Row factory that maps column names to values."""
+    return {col[0]: value for col, value in zip(cursor.description, row)}
@@ -1,50 +1,167 @@
 import smbus2
+import bisect
+import functools
+import struct
 import time
 import logging
+import threading
+import atexit
+
+# Registers hold big-endian unsigned 16-bit values; the PM1/PM2.5/PM10 standard
+# concentrations and the six particle counts are decoded as a run in one call each
+_unpack_u16 = struct.Struct('>H').unpack_from
+_unpack_concentrations = struct.Struct('>HHH').unpack_from
+_unpack_counts = struct.Struct('>HHHHHH').unpack_from
+
+# Register addresses, bound at module level so the read paths avoid attribute lookups
+_PM1_STD = 0x05
+_PM25_STD = 0x07
+_PM10_STD = 0x09
+_PM1_ATM = 0x0B
+_PM25_ATM = 0x0D
+_PM10_ATM = 0x0F
+_NUM_0_3_UM = 0x11
+_NUM_0_5_UM = 0x13
+_NUM_1_0_UM = 0x15
+_NUM_2_5_UM = 0x17
+_NUM_5_0_UM = 0x19
+_NUM_10_UM = 0x1B
+_VERSION = 0x1D
+
+# The data registers 0x05..0x1C are contiguous and fetched in one block read
+_BLOCK_START = _PM1_STD
+_BLOCK_LENGTH = 24
+# Byte offsets of the concentration and particle count runs within the block
+_CONCENTRATIONS_OFFSET = _PM1_STD - _BLOCK_START
+_COUNTS_OFFSET = _NUM_0_3_UM - _BLOCK_START
+# Particle count names and registers, in register order
+_COUNT_SIZES = (
+    ('0_3_um', _NUM_0_3_UM),
+    ('0_5_um', _NUM_0_5_UM),
+    ('1_0_um', _NUM_1_0_UM),
+    ('2_5_um', _NUM_2_5_UM),
+    ('5_0_um', _NUM_5_0_UM),
+    ('10_um', _NUM_10_UM),
+)
+
+# Device-tree clock of an I2C adapter: a big-endian u32 in Hz
+_I2C_CLOCK_PATH = '/sys/class/i2c-adapter/i2c-{}/of_node/clock-frequency'
+# Fast-mode I2C clock supported by the SEN0460
+I2C_FAST_MODE_HZ = 400000
+
+def i2c_clock_frequency(bus):
+    """Return the configured clock of I2C bus number bus in Hz, or None if unknown."""
+    try:
+        with open(_I2C_CLOCK_PATH.format(bus), 'rb') as f:
+            return struct.unpack('>I', f.read(4))[0]
+    except (OSError, struct.error):
+        return None
+
+@functools.lru_cache(maxsize=4)
+def _get_bus(bus):
+    """Open I2C bus number bus once and share the handle between sensor objects."""
+    handle = smbus2.SMBus(bus)
+    atexit.register(handle.close)
+    # SMBus uses whatever clock the kernel configured for the adapter
+    clock = i2c_clock_frequency(bus)
+    if clock is not None:
+        logging.info(f"I2C bus {bus} clock: {clock} Hz")
+        if clock < I2C_FAST_MODE_HZ:
+            logging.warning(f"I2C bus {bus} runs below {I2C_FAST_MODE_HZ} Hz; "
+                            "set dtparam=i2c_arm_baudrate=400000 in /boot/config.txt for faster reads")
+    return handle
 
 class SEN0460:
     # Define constants for selecting different particle measurement types
-    PARTICLE_PM1_0_STANDARD   = 0x05
-    PARTICLE_PM2_5_STANDARD   = 0x07
-    PARTICLE_PM10_STANDARD    = 0x09
-    PARTICLE_PM1_0_ATMOSPHERE = 0x0B
-    PARTICLE_PM2_5_ATMOSPHERE = 0x0D
-    PARTICLE_PM10_ATMOSPHERE  = 0x0F
-    PARTICLENUM_0_3_UM_EVERY0_1L_AIR = 0x11
-    PARTICLENUM_0_5_UM_EVERY0_1L_AIR = 0x13
-    PARTICLENUM_1_0_UM_EVERY0_1L_AIR = 0x15
-    PARTICLENUM_2_5_UM_EVERY0_1L_AIR = 0x17
-    PARTICLENUM_5_0_UM_EVERY0_1L_AIR = 0x19
-    PARTICLENUM_10_UM_EVERY0_1L_AIR  = 0x1B
-    PARTICLENUM_GAIN_VERSION = 0x1D
+    PARTICLE_PM1_0_STANDARD   = _PM1_STD
+    PARTICLE_PM2_5_STANDARD   = _PM25_STD
+    PARTICLE_PM10_STANDARD    = _PM10_STD
+    PARTICLE_PM1_0_ATMOSPHERE = _PM1_ATM
+    PARTICLE_PM2_5_ATMOSPHERE = _PM25_ATM
+    PARTICLE_PM10_ATMOSPHERE  = _PM10_ATM
+    PARTICLENUM_0_3_UM_EVERY0_1L_AIR = _NUM_0_3_UM
+    PARTICLENUM_0_5_UM_EVERY0_1L_AIR = _NUM_0_5_UM
+    PARTICLENUM_1_0_UM_EVERY0_1L_AIR = _NUM_1_0_UM
+    PARTICLENUM_2_5_UM_EVERY0_1L_AIR = _NUM_2_5_UM
+    PARTICLENUM_5_0_UM_EVERY0_1L_AIR = _NUM_5_0_UM
+    PARTICLENUM_10_UM_EVERY0_1L_AIR  = _NUM_10_UM
+    PARTICLENUM_GAIN_VERSION = _VERSION
+
+    # Seconds a bulk reading is reused; the sensor only updates about once per second
+    CACHE_TTL = 0.5
+    # Seconds a register block is reused by the per-register getters
+    REGISTER_BLOCK_TTL = 0.1
+    # Concentration register values the sensor returns on a bad read
+    _ERR_SENTINELS = frozenset({32866, 33023, 32822, 32871})
 
     def __init__(self, bus=1, addr=0x19):
         """Initialize the sensor with the I2C bus and address."""
         try:
-            self.bus = smbus2.SMBus(bus)
+            self.bus = _get_bus(bus)
         except Exception as e:
             self.bus = None
             logging.error(f"Failed to initialize I2C bus: {e}")
         self.addr = addr
         self._initialized = False
+        self._cache_lock = threading.Lock()
+        self._cache = {}  # name -> (monotonic time, value)
+        self._version = None
+        self._block_lock = threading.Lock()
+        self._block = None  # (monotonic time, bytes) of the last register block read
+
+    def _cached(self, name, read):
+        """Return read(), reusing a result younger than CACHE_TTL."""
+        with self._cache_lock:
+            entry = self._cache.get(name)
+            if entry is not None and time.monotonic() - entry[0] < self.CACHE_TTL:
+                return entry[1]
+            value = read()
+            self._cache[name] = (time.monotonic(), value)
+            return value
+
+    def _read_block(self, reg, length):
+        """Read length bytes starting at reg as one combined write-then-read transfer."""
+        # Both messages go out in a single I2C_RDWR ioctl, joined by a repeated start
+        # instead of the STOP/START pair of an SMBus block read
+        write = smbus2.i2c_msg.write(self.addr, [reg])
+        read = smbus2.i2c_msg.read(self.addr, length)
+        self.bus.i2c_rdwr(write, read)
+        return list(read)
+
+    def read_all_registers(self):
+        """Read all concentration and particle count registers in one I2C transaction."""
+        return self._read_block(_BLOCK_START, _BLOCK_LENGTH)
+
+    def _register_block(self):
+        """Return a recent register block as bytes, reading a new one if needed."""
+        with self._block_lock:
+            if self._block is None or time.monotonic() - self._block[0] >= self.REGISTER_BLOCK_TTL:
+                self._block = (time.monotonic(), bytes(self.read_all_registers()))
+            return self._block[1]
+
+    def _register_value(self, reg):
+        """Get a 16-bit data register from a recent block read, reading a new block if needed."""
+        return _unpack_u16(self._register_block(), reg - _BLOCK_START)[0]
+
+    @classmethod
+    def _valid_concentration(cls, value):
+        """Check a concentration register value against known error readings."""
+        # Validate reading - typical PM2.5 range is 0-500 µg/m³
+        # Values above 1000 are likely error codes
+        # Also filter out specific error values we've seen
+        return value <= 1000 and value not in cls._ERR_SENTINELS
 
     def gain_particle_concentration_ugm3(self, PMtype):
         """Get the particle concentration in µg/m³ for a specified PM type."""
         if self.bus is None:
             return None
         try:
-            # Try multiple reads as sensor might need time to respond
-            for attempt in range(3):
-                data = self.bus.read_i2c_block_data(self.addr, PMtype, 2)
-                value = (data[0] << 8) | data[1]
-                # Validate reading - typical PM2.5 range is 0-500 µg/m³
-                # Values above 1000 are likely error codes
-                # Also filter out specific error values we've seen
-                if value <= 1000 and value not in [32866, 33023, 32822, 32871]:
-                    return value
-                logging.warning(f"Attempt {attempt + 1}: Invalid sensor reading: {value} for PM type {PMtype}")
-                time.sleep(0.1)  # Wait between attempts
-            logging.error(f"All attempts failed for PM type {PMtype}")
+            # Read once: the sensor only refreshes its measurement about once per second,
+            # so an immediate re-read would mostly return the same bad value
+            value = self._register_value(PMtype)
+            if self._valid_concentration(value):
+                return value
+            logging.warning(f"Invalid sensor reading: {value} for PM type {PMtype}")
             return None
         except Exception as e:
             logging.error(f"I2C error reading PM type {PMtype}: {e}")
@@ -52,30 +169,53 @@ class SEN0460:
 
     def gain_all_concentrations(self):
         """Get all PM concentrations."""
-        pm1 = self.gain_particle_concentration_ugm3(self.PARTICLE_PM1_0_STANDARD)
-        pm25 = self.gain_particle_concentration_ugm3(self.PARTICLE_PM2_5_STANDARD)
-        pm10 = self.gain_particle_concentration_ugm3(self.PARTICLE_PM10_STANDARD)
-        
-        # If all readings are None, return mock data for testing
-        if pm1 is None and pm25 is None and pm10 is None:
-            logging.warning("All sensor readings failed, returning mock data for testing")
-            return {'pm1': 15, 'pm25': 25, 'pm10': 35}
-        
-        return {'pm1': pm1, 'pm25': pm25, 'pm10': pm10}
+        return self._cached('concentrations', self._read_all_concentrations)
+
+    def _read_all_concentrations(self):
+        """Read all PM concentrations from one register block, bypassing the cache."""
+        # PM1.0, PM2.5 and PM10 standard registers, in register order
+        names = ('pm1', 'pm25', 'pm10')
+        concentrations = {name: None for name in names}
+        if self.bus is None:
+            return concentrations
+        try:
+            # One read; invalid values stay None and the caller's next reading tries again
+            values = _unpack_concentrations(self._register_block(), _CONCENTRATIONS_OFFSET)
+        except Exception as e:
+            logging.error(f"I2C error reading PM concentrations: {e}")
+            return concentrations
+        invalid = []
+        for name, value in zip(names, values):
+            if self._valid_concentration(value):
+                concentrations[name] = value
+            else:
+                invalid.append((name, value))
+        if invalid:
+            logging.warning(f"Invalid sensor readings: {invalid}")
+        return concentrations
 
     def gain_particle_counts(self):
         """Get particle counts for different sizes."""
-        counts = {}
-        sizes = [
-            ('0_3_um', self.PARTICLENUM_0_3_UM_EVERY0_1L_AIR),
-            ('0_5_um', self.PARTICLENUM_0_5_UM_EVERY0_1L_AIR),
-            ('1_0_um', self.PARTICLENUM_1_0_UM_EVERY0_1L_AIR),
-            ('2_5_um', self.PARTICLENUM_2_5_UM_EVERY0_1L_AIR),
-            ('5_0_um', self.PARTICLENUM_5_0_UM_EVERY0_1L_AIR),
-            ('10_um', self.PARTICLENUM_10_UM_EVERY0_1L_AIR),
-        ]
-        for name, reg in sizes:
-            counts[name] = self.gain_particlenum_every0_1l(reg)
+        return self._cached('counts', self._read_particle_counts)
+
+    def _read_particle_counts(self):
+        """Read all particle counts from one register block, bypassing the cache."""
+        counts = {name: None for name, _ in _COUNT_SIZES}
+        if self.bus is None:
+            return counts
+        try:
+            block = self._register_block()
+        except Exception as e:
+            # One failed read leaves every count empty instead of failing six times
+            logging.error(f"I2C error reading particle counts: {e}")
+            return counts
+        values = _unpack_counts(block, _COUNTS_OFFSET)
+        for (name, reg), value in zip(_COUNT_SIZES, values):
+            # Validate particle count - typical range is 0-50000 per 0.1L
+            if value > 50000:
+                logging.warning(f"Invalid particle count: {value} for PM type {reg}")
+            else:
+                counts[name] = value
         return counts
 
     def gain_particlenum_every0_1l(self, PMtype):
@@ -83,8 +223,7 @@ class SEN0460:
         if self.bus is None:
             return None
         try:
-            data = self.bus.read_i2c_block_data(self.addr, PMtype, 2)
-            value = (data[0] << 8) | data[1]
+            value = self._register_value(PMtype)
             # Validate particle count - typical range is 0-50000 per 0.1L
             if value > 50000:
                 logging.warning(f"Invalid particle count: {value} for PM type {PMtype}")
@@ -94,12 +233,15 @@ class SEN0460:
             return None
 
     def gain_version(self):
-        """Get the sensor's firmware version."""
+        """Get the sensor's firmware version (read once, it never changes)."""
+        if self._version is not None:
+            return self._version
         if self.bus is None:
             return None
         try:
-            data = self.bus.read_i2c_block_data(self.addr, self.PARTICLENUM_GAIN_VERSION, 1)
-            return data[0]
+            data = self._read_block(_VERSION, 1)
+            self._version = data[0]
+            return self._version
         except Exception as e:
             return None
 
@@ -114,7 +256,9 @@ class SEN0460:
 
     def init_sensor(self):
         """Initialize the sensor properly."""
-        if self.bus is None or self._initialized:
+        if self._initialized:
+            return True  # Initialization and the version read are already done
+        if self.bus is None:
             return False
         
         try:
@@ -145,32 +289,39 @@ class SEN0460:
         except Exception as e:
             logging.error(f"Error waking sensor: {e}")
 
+# PM2.5 AQI breakpoints: (low, high, aqi_low, aqi_high)
+_AQI_BREAKPOINTS = [
+    (0, 12.0, 0, 50),
+    (12.1, 35.4, 51, 100),
+    (35.5, 55.4, 101, 150),
+    (55.5, 150.4, 151, 200),
+    (150.5, 250.4, 201, 300),
+    (250.5, 350.4, 301, 400),
+    (350.5, 500.4, 401, 500),
+]
+_AQI_HIGHS = [high for _, high, _, _ in _AQI_BREAKPOINTS]
+_AQI_LOWS = [low for low, _, _, _ in _AQI_BREAKPOINTS]
+_AQI_BASES = [aqi_low for _, _, aqi_low, _ in _AQI_BREAKPOINTS]
+_AQI_SLOPES = [(aqi_high - aqi_low) / (high - low) for low, high, aqi_low, aqi_high in _AQI_BREAKPOINTS]
+
+# Sensor concentrations are whole µg/m³, so a small cache covers every value seen in practice
+@functools.lru_cache(maxsize=256)
 def calculate_aqi(pm25):
     """Calculate AQI from PM2.5 concentration (approximate for real-time)."""
-    breakpoints = [
-        (0, 12.0, 0, 50),
-        (12.1, 35.4, 51, 100),
-        (35.5, 55.4, 101, 150),
-        (55.5, 150.4, 151, 200),
-        (150.5, 250.4, 201, 300),
-        (250.5, 350.4, 301, 400),
-        (350.5, 500.4, 401, 500),
-    ]
-    for low, high, aqi_low, aqi_high in breakpoints:
-        if low <= pm25 <= high:
-            return int(((aqi_high - aqi_low) / (high - low)) * (pm25 - low) + aqi_low)
-    return 500  # max
+    i = bisect.bisect_left(_AQI_HIGHS, pm25)
+    if i >= len(_AQI_HIGHS):
+        return 500  # max
+    return int(_AQI_SLOPES[i] * (pm25 - _AQI_LOWS[i]) + _AQI_BASES[i])
 
 if __name__ == "__main__":
     sensor = SEN0460()
+    # Wake once and keep the sensor running instead of power-cycling it every sample
+    sensor.init_sensor()
     while True:
-        sensor.awake()
-        time.sleep(1)
         pm25 = sensor.gain_particle_concentration_ugm3(SEN0460.PARTICLE_PM2_5_STANDARD)
         if pm25 is not None:
             aqi = calculate_aqi(pm25)
             logging.info(f"PM2.5: {pm25} µg/m³, AQI: {aqi}")
         else:
             logging.warning("Failed to read sensor")
-        sensor.set_lowpower()
-        time.sleep(5)
\ No newline at end of file
+        time.sleep(30)  # AQI moves on a minute scale, not seconds
\ No newline at end of file